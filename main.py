@@ -1,9 +1,14 @@
+import math
+
 import numpy as np
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field, replace
+from typing import List, Optional
+
+
+G0 = 9.81  # standard gravity in m/s²
 
 
-@dataclass
+@dataclass(slots=True)
 class Propellant:
     name: str
     isp: float  # specific impulse in seconds
@@ -18,28 +23,46 @@ PROPELLANTS = {
     'Solid': Propellant('Solid', 280, 1500),         # Solid rocket motor
 }
 
+# PROPELLANTS as parallel arrays for the vectorized search
+_NAMES = list(PROPELLANTS)
+_DENSITY = np.array([PROPELLANTS[name].density for name in _NAMES])
+# float32 is ample precision to rank propellants, so the search's delta-v table is single precision
+_EXHAUST_VELOCITY = np.array([G0 * PROPELLANTS[name].isp for name in _NAMES], dtype=np.float32)  # m/s
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class Stage:
     propellant: Propellant
     dry_mass: float  # kg
     propellant_mass: float  # kg
     payload_mass: float  # kg
-    g0 = 9.81 # standard gravity in m/s²
+    mass_flow_rate: Optional[float] = field(default=None, repr=False)  # kg/s
+    # derived from the masses once in __post_init__ rather than on every access, which is
+    # only safe because the stage is frozen
+    _total_mass: float = field(init=False, repr=False, compare=False)
+    _mass_ratio: float = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        total_mass = self.dry_mass + self.propellant_mass + self.payload_mass
+        object.__setattr__(self, '_total_mass', total_mass)
+        object.__setattr__(self, '_mass_ratio', total_mass / (self.dry_mass + self.payload_mass))
 
     @property
     def total_mass(self) -> float:
-        return self.dry_mass + self.propellant_mass + self.payload_mass
+        return self._total_mass
 
     @property
     def mass_ratio(self) -> float:
-        return self.total_mass / (self.dry_mass + self.payload_mass)
+        return self._mass_ratio
 
     def delta_v(self) -> float:
-        return self.g0 * self.propellant.isp * np.log(self.mass_ratio)
+        return G0 * self.propellant.isp * math.log(self.mass_ratio)
 
     def thrust(self) -> float:
-        return np.gradient(self.g0*self.propellant.isp)
+        if self.mass_flow_rate is None:
+            raise ValueError("thrust needs the stage's mass_flow_rate")
+        # thrust in newtons: mass flow rate times exhaust velocity
+        return self.mass_flow_rate * G0 * self.propellant.isp
     
     @property
     def propellant_volume(self) -> float:
@@ -47,64 +70,81 @@ class Stage:
         return self.propellant_mass / self.propellant.density
 
 
+@dataclass(slots=True)
+class StageArray:
+    """The masses the propellant search needs from a list of stages, one entry per stage."""
+    propellant_mass: np.ndarray  # kg
+    mass_ratio: np.ndarray
+
+    @classmethod
+    def from_stages(cls, stages: List[Stage]) -> 'StageArray':
+        return cls(
+            np.array([stage.propellant_mass for stage in stages], dtype=float),
+            np.array([stage.mass_ratio for stage in stages], dtype=float),
+        )
+
+    def log_mass_ratio(self, dtype=float) -> np.ndarray:
+        # mass ratios don't depend on the propellant, so the log is only taken once per stage
+        return np.log(self.mass_ratio.astype(dtype, copy=False))
+
+
 class Rocket:
     def __init__(self, stages: List[Stage]):
-        self.stages = stages
+        self.stages = tuple(stages)
 
     def total_delta_v(self) -> float:
-        return sum(stage.delta_v() for stage in self.stages)
+        return sum(map(Stage.delta_v, self.stages))
 
     def __str__(self):
-        result = f"highest delta v: {self.total_delta_v()}. \nrocket stages: "
-        for stage in self.stages:
-            result += stage.__str__() + "\n"
-        return result
+        stages = "".join(f"{stage}\n" for stage in self.stages)
+        return f"highest delta v: {self.total_delta_v()}. \nrocket stages: {stages}"
 
 
-def find_all_stage_combinations(stages) -> List[List[Stage]]:
-    stage_combinations = []
-    # MAX_VOLUMES = [2500, 1000, 300]  # example constraint per stage (m³)
-
-    combinations = generate_combinations(PROPELLANTS.values(), len(stages))
-    for combination in combinations:
-        new_stages = []
-        for i in range(len(stages)):
-            stage = Stage(combination[i], stages[i].dry_mass, stages[i].propellant_mass, stages[i].payload_mass)
-            new_stages.append(stage)
-        # if all(s.propellant_volume <= MAX_VOLUMES[i] for i, s in enumerate(new_stages)):
-        stage_combinations.append(new_stages)
+def _best_propellants(exhaust_velocity, log_mass_ratios, propellant_masses, density, max_volumes):
+    """
+    :param exhaust_velocity: exhaust velocity (g0 * isp) of each propellant, shape (propellants,)
+    :param log_mass_ratios: log of each stage's mass ratio, shape (stages,)
+    :param propellant_masses: propellant mass of each stage, shape (stages,)
+    :param density: density of each propellant, shape (propellants,)
+    :param max_volumes: propellant volume limit of each stage, shape (stages,)
+    :return: the index of the best fitting propellant for each stage
+    """
+    # delta v of every (stage, propellant) pair, shape (stages, propellants)
+    stage_delta_vs = log_mass_ratios[:, None] * exhaust_velocity[None, :]
+    fits = propellant_masses[:, None] / density[None, :] <= max_volumes[:, None]
+    if not fits.any(axis=1).all():
+        raise ValueError("no propellant fits within the volume limit of every stage")
+    stage_delta_vs = np.where(fits, stage_delta_vs, -np.inf)
 
-    return stage_combinations
+    # a stage's delta v only depends on its own propellant, so the total is maximised by
+    # picking the best propellant for each stage independently
+    return stage_delta_vs.argmax(axis=1)
 
 
-def generate_combinations(possible_options, n) -> List[List[any]]:
+def find_best_rocket(stages: List[Stage], max_volumes: Optional[List[float]] = None) -> Rocket:
     """
-    :param possible_options: a list of options to  pull from
-    :param n: how long each list should be
-    :return: A list of lists, of all possible ordered combinations, drawn from possible_options, for a list length n
+    :param stages: the stages whose masses are kept while the propellants are swapped out
+    :param max_volumes: optional propellant volume limit for each stage in m³, e.g. [2500, 1000, 300]
+    :return: the Rocket with the highest total delta v over every assignment of PROPELLANTS to stages
     """
-    result = []
-
-    def recursive_generate_combinations(current_combo, depth):
-        if depth == n:
-            result.append(current_combo)
-            return
-        for prop in possible_options:
-            recursive_generate_combinations(current_combo + [prop], depth + 1)
-    recursive_generate_combinations([], 0)
-    return result
-
-
-def find_best_rocket(combinations: List[List[Stage]]) -> Rocket:
-    highest_delta_v = -1
-    best_rocket = Rocket(combinations[0])
-    for combination in combinations:
-        rocket = Rocket(combination)
-        delta_v = rocket.total_delta_v()
-        if delta_v > highest_delta_v:
-            highest_delta_v = delta_v
-            best_rocket = rocket
-    return best_rocket
+    if max_volumes is None:
+        max_volumes = [np.inf] * len(stages)
+    elif len(max_volumes) != len(stages):
+        raise ValueError(f"expected {len(stages)} max_volumes, one per stage, got {len(max_volumes)}")
+    stage_array = StageArray.from_stages(stages)
+    best = _best_propellants(
+        _EXHAUST_VELOCITY,
+        # single precision to match _EXHAUST_VELOCITY, cast before the log so it runs in float32
+        stage_array.log_mass_ratio(np.float32),
+        stage_array.propellant_mass,
+        _DENSITY,
+        np.array(max_volumes, dtype=float),
+    )
+
+    return Rocket([
+        replace(stage, propellant=PROPELLANTS[_NAMES[i]])
+        for i, stage in zip(best, stages)
+    ])
 
 
 def main():
@@ -116,8 +156,7 @@ def main():
     ]
 
     print(f"Originally, saturn v has a total Δv of {Rocket(original_saturn_v_stages).total_delta_v()}")
-    combinations = find_all_stage_combinations(original_saturn_v_stages)
-    best_rocket = find_best_rocket(combinations)
+    best_rocket = find_best_rocket(original_saturn_v_stages)
     print(best_rocket)
     print(f"Using different fuel combinations in the saturn v rocket, the best combinations can have a Δv{best_rocket.total_delta_v()}")
 